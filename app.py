@@ -1,11 +1,105 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context
 from tinydb import TinyDB, Query
 import pandas as pd
 import os
+import json
+import time
+import threading
+import changelog
 
 app = Flask(__name__)
 db_path = 'stores_db.json'
 db = TinyDB(db_path)
+log_path = changelog.LOG_PATH
+
+# --- In-process Store Cache ---
+# Loaded from the DB once, then kept current by applying events from the change log
+# (written by the scraper, the enricher and update_locations) instead of re-reading the DB.
+# Falls back to a full reload if the DB file changes without a matching log entry.
+_cache_lock = threading.Lock()
+_records = {}  # store_code -> full record
+_rows = {}     # store_code -> table row served by /api/stores
+_log_offset = None
+_log_id = None
+_db_mtime = None
+
+def _mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except FileNotFoundError:
+        return 0
+
+def summarize_store(r):
+    # Calculate Avg TAT
+    yearly_data = r.get('yearly_data', [])
+    tat_values = []
+    for row in yearly_data:
+         val = str(row.get('% Delivered within TAT', '0')).replace('%', '').strip()
+         if val and val != '-':
+             try:
+                 tat_values.append(float(val))
+             except: pass
+    
+    avg_tat = sum(tat_values) / len(tat_values) if tat_values else 0
+
+    return {
+        'store_code': r.get('store_code'),
+        'store_name': r.get('store_name'),
+        'city': r.get('city', 'Unknown'),
+        'state': r.get('state', 'Unknown'),
+        'status': r.get('status', 'Unknown'),
+        'launch_date': r.get('launch_date', 'Unknown'),
+        'avg_tat': round(avg_tat, 1)
+    }
+
+def _apply_change(event):
+    store_code = event.get('store_code')
+    record = _records.get(store_code)
+    if record is None:
+        # Mirrors TinyDB: update() on a missing record is a no-op, upsert() inserts
+        if event.get('op') != 'upsert': return
+        record = _records[store_code] = {}
+    record.update(event.get('fields', {}))
+    _rows[store_code] = summarize_store(record)
+
+def sync_cache():
+    global _log_offset, _log_id, _db_mtime
+    with _cache_lock:
+        size = changelog.log_size(path=log_path)
+        log_id = changelog.log_id(path=log_path)
+        # Every logged write touches the log after the DB, so a DB newer than the log
+        # means a write without a log line (crash in between, restored file, old writer)
+        db_mtime = _mtime(db_path)
+        unlogged_write = db_mtime > _mtime(log_path) and db_mtime != _db_mtime
+        # A log created after the last load is read from the start, not treated as a rotation
+        rotated = _log_id is not None and log_id != _log_id
+        if _log_offset is None or size < _log_offset or rotated or unlogged_write:
+            # First use, the log was truncated or rotated, or the DB changed behind it: full reload.
+            # Take the offset before reading the DB so no later write is missed;
+            # replaying an already-applied event is harmless.
+            _log_offset = size
+            _log_id = log_id
+            _db_mtime = db_mtime
+            _records.clear()
+            _rows.clear()
+            for r in db.all():
+                _records[r.get('store_code')] = dict(r)
+                _rows[r.get('store_code')] = summarize_store(r)
+            return
+        
+        _log_id = log_id
+        events, _log_offset = changelog.read_changes(_log_offset, path=log_path)
+        for event in events:
+            _apply_change(event)
+
+def _resume_token(log_id, offset):
+    # Offsets are only meaningful within one log file, so the token names the file too
+    return f"{log_id or 0}:{offset}"
+
+def _parse_resume_token(token):
+    log_id, _, offset = token.partition(':')
+    if not (log_id.isdigit() and offset.isdigit()): return None
+    return int(log_id), int(offset)
 
 @app.route('/')
 def index():
@@ -29,28 +123,18 @@ def api_stores():
     f_state = request.args.get('state', '').lower()
     f_status = request.args.get('status', '').lower()
     
-    all_records = db.all()
+    sync_cache()
+    with _cache_lock:
+        all_rows = list(_rows.values())
+        resume_token = _resume_token(_log_id, _log_offset)
     filtered_records = []
     
-    for r in all_records:
+    for r in all_rows:
         r_code = str(r.get('store_code', '')).lower()
         r_name = str(r.get('store_name', '')).lower()
-        r_city = str(r.get('city', 'Unknown')).lower()
-        r_state = str(r.get('state', 'Unknown')).lower()
-        r_status = str(r.get('status', 'Unknown')).lower()
-        r_launch = str(r.get('launch_date', 'Unknown')).lower()
-
-        # Calculate Avg TAT
-        yearly_data = r.get('yearly_data', [])
-        tat_values = []
-        for row in yearly_data:
-             val = str(row.get('% Delivered within TAT', '0')).replace('%', '').strip()
-             if val and val != '-':
-                 try:
-                     tat_values.append(float(val))
-                 except: pass
-        
-        avg_tat = sum(tat_values) / len(tat_values) if tat_values else 0
+        r_city = str(r.get('city')).lower()
+        r_state = str(r.get('state')).lower()
+        r_status = str(r.get('status')).lower()
 
         # Global Search
         if search:
@@ -65,15 +149,7 @@ def api_stores():
         if f_state and f_state not in r_state: continue
         if f_status and f_status != 'all' and f_status != r_status: continue
 
-        filtered_records.append({
-            'store_code': r.get('store_code'),
-            'store_name': r.get('store_name'),
-            'city': r.get('city', 'Unknown'),
-            'state': r.get('state', 'Unknown'),
-            'status': r.get('status', 'Unknown'),
-            'launch_date': r.get('launch_date', 'Unknown'),
-            'avg_tat': round(avg_tat, 1)
-        })
+        filtered_records.append(r)
     
     # Sorting
     sort_by = request.args.get('sort_by', '')
@@ -98,18 +174,22 @@ def api_stores():
         'total': total_count,
         'page': page,
         'limit': limit,
-        'data': paginated_data
+        'data': paginated_data,
+        # Log position this data reflects; pass as ?since= to /api/changes
+        'offset': resume_token
     })
 
 @app.route('/api/stats/<store_code>')
 def api_stats(store_code):
-    Store = Query()
-    record = db.search(Store.store_code == store_code)
+    sync_cache()
+    with _cache_lock:
+        record = _records.get(store_code)
+        resume_token = _resume_token(_log_id, _log_offset)
     
     if not record:
         return jsonify({'error': 'Store not found'}), 404
         
-    data = record[0].get('yearly_data', [])
+    data = record.get('yearly_data', [])
     
     # Robust Sorting: Parse date and sort chronologically
     # Format expected: "Jan, 2024"
@@ -167,7 +247,7 @@ def api_stats(store_code):
         growth.append(clean_num(item['Revenue Growth Vs Last Month %']))
 
     return jsonify({
-        'store_name': record[0].get('store_name'),
+        'store_name': record.get('store_name'),
         'labels': months,
         'revenue': revenue,
         'chemical': chemical,
@@ -176,8 +256,9 @@ def api_stats(store_code):
         'packaging_pct': packaging_pct,
         'tat_pct': tat_pct,
         'growth': growth,
+        'offset': resume_token,
         'kpis': {
-            'store_age': calculate_store_age(record[0].get('launch_date', '')),
+            'store_age': calculate_store_age(record.get('launch_date', '')),
             'lifetime_revenue': sum(revenue),
             'avg_monthly_revenue': sum(revenue) / len(revenue) if revenue else 0,
             'efficiency_score': (sum(revenue) / (sum(chemical) + sum(packaging))) if (sum(chemical) + sum(packaging)) > 0 else 0,
@@ -216,7 +297,6 @@ def update_locations():
     updates = data.get('updates', [])
     count = 0
     
-    Store = Query()
     for item in updates:
         store_code = item.get('storeCode')
         city = item.get('city')
@@ -227,11 +307,71 @@ def update_locations():
             if city is not None: payload['city'] = city
             if state is not None: payload['state'] = state
             
-            if payload:
-                db.update(payload, Store.store_code == store_code)
+            # Saving a cell with its current value writes and logs nothing
+            if payload and changelog.save_store(db, store_code, payload, path=log_path):
                 count += 1
                 
     return jsonify({'success': True, 'updated': count})
 
+@app.route('/api/changes')
+def api_changes():
+    """
+    Server-Sent Events stream of store changes. Each event carries the store's fresh table row
+    and the names of the fields that changed, so pages can patch in place instead of reloading.
+    """
+    # Resume after the last event the browser saw, else from the position the page's data was
+    # read at (?since=), else from the current end of the log
+    token = request.headers.get('Last-Event-ID', '') or request.args.get('since', '')
+    resume = _parse_resume_token(token)
+    log_id = changelog.log_id(path=log_path)
+    if resume is None:
+        offset = changelog.log_size(path=log_path)
+    elif resume[0] == (log_id or 0):
+        offset = resume[1]
+    else:
+        offset = 0  # Log was rotated or recreated since the token was issued
+
+    def stream():
+        nonlocal offset, log_id
+        idle = 0
+        yield 'retry: 3000\n\n'
+        while True:
+            current_id = changelog.log_id(path=log_path)
+            if changelog.log_size(path=log_path) < offset or (log_id is not None and current_id != log_id):
+                offset = 0  # Log was truncated or rotated
+            log_id = current_id
+            events, offset = changelog.read_changes(offset, path=log_path)
+            if events:
+                sync_cache()
+                # Coalesce several writes to the same store into one message, identified by
+                # the store's last event so a reconnect resumes right after it
+                changed = {}
+                for event in events:
+                    entry = changed.setdefault(event.get('store_code'), {'op': 'update', 'fields': set()})
+                    if event.get('op') == 'upsert': entry['op'] = 'upsert'
+                    entry['fields'].update(event.get('fields', {}).keys())
+                    entry['id'] = event['id']
+                with _cache_lock:
+                    rows = {store_code: _rows.get(store_code) for store_code in changed}
+                for store_code, entry in sorted(changed.items(), key=lambda item: item[1]['id']):
+                    payload = {
+                        'store_code': store_code,
+                        'op': entry['op'],
+                        'fields': sorted(entry['fields']),
+                        'row': rows[store_code]
+                    }
+                    yield f"id: {_resume_token(log_id, entry['id'])}\ndata: {json.dumps(payload)}\n\n"
+                idle = 0
+            else:
+                idle += 1
+                # Comment line keeps proxies from closing the idle connection
+                if idle >= 15:
+                    yield ': keepalive\n\n'
+                    idle = 0
+            time.sleep(1)
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
@@ -0,0 +1,98 @@
+import json
+import os
+from datetime import datetime
+from tinydb import Query
+
+# Append-only log of store changes, one compact JSON event per line.
+# Writers (scraper, enricher, web app) append after every DB write; readers
+# (the web app's cache and its /api/changes stream) tail it by byte offset.
+LOG_PATH = 'stores_changes.jsonl'
+# Once the log passes this size it is moved to `<path>.1` and a fresh one is started.
+# Readers notice the reset (smaller size / new file) and reload from the DB.
+MAX_LOG_BYTES = 5 * 1024 * 1024
+
+def changed_fields(current, fields, ignore=()):
+    """
+    Returns the subset of `fields` whose values differ from `current` (a stored record or None).
+    Keys in `ignore` never count as a change on their own.
+    """
+    current = current or {}
+    return {k: v for k, v in fields.items() if k not in ignore and current.get(k) != v}
+
+def append_change(store_code, fields, op='update', path=LOG_PATH):
+    """
+    Appends a change event for a store. `fields` holds only the keys that were written.
+    op is 'upsert' (record may be new) or 'update' (existing record only).
+    """
+    event = {
+        "ts": datetime.now().isoformat(),
+        "op": op,
+        "store_code": store_code,
+        "fields": fields
+    }
+    line = json.dumps(event, separators=(',', ':'), ensure_ascii=False) + '\n'
+    if log_size(path) >= MAX_LOG_BYTES:
+        os.replace(path, path + '.1')
+    # A single write on an O_APPEND file keeps lines from separate processes intact
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(line)
+
+def save_store(db, store_code, fields, upsert=False, ignore=(), path=LOG_PATH):
+    """
+    Writes `fields` to a store's DB record and logs them, skipping both when nothing changed,
+    so every DB write has a matching log line. Keys in `ignore` (e.g. timestamps) are written
+    along with real changes but never cause a write on their own.
+    With upsert=False a missing store is left alone, like TinyDB's update().
+    Returns the fields that were written.
+    """
+    Store = Query()
+    existing = db.get(Store.store_code == store_code)
+    if existing is None:
+        if not upsert: return {}
+        db.upsert(fields, Store.store_code == store_code)
+        append_change(store_code, fields, op='upsert', path=path)
+        return fields
+    
+    changes = changed_fields(existing, fields, ignore=ignore)
+    if not changes: return {}
+    changes.update({k: fields[k] for k in ignore if k in fields})
+    db.update(changes, Store.store_code == store_code)
+    append_change(store_code, changes, path=path)
+    return changes
+
+def log_size(path=LOG_PATH):
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+def log_id(path=LOG_PATH):
+    """Identifies the current log file, so readers can tell when it was rotated."""
+    try:
+        return os.stat(path).st_ino
+    except FileNotFoundError:
+        return None
+
+def read_changes(offset=0, path=LOG_PATH):
+    """
+    Reads complete events written after `offset`.
+    Returns (events, new_offset); each event's 'id' is the offset just past its line.
+    """
+    events = []
+    try:
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                # Stop at a line that is still being written
+                if not line.endswith(b'\n'):
+                    break
+                offset += len(line)
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                event['id'] = offset
+                events.append(event)
+    except FileNotFoundError:
+        pass
+    return events, offset
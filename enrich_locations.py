@@ -2,6 +2,7 @@ import time
 from tinydb import TinyDB, Query
 from geopy.geocoders import Nominatim
 from geopy.exc import GeocoderTimedOut
+from changelog import append_change, changed_fields
 
 # Mapping of major Indian cities to their states
 INDIA_CITIES = {
@@ -147,8 +148,11 @@ def main():
              if not current_city: updates['city'] = "Unknown"
              if not current_state: updates['state'] = "Unknown"
         
+        # Drop values the record already has (e.g. re-enriching to the same "Unknown")
+        updates = changed_fields(record, updates)
         if updates:
             db.update(updates, Store.store_code == store_code)
+            append_change(store_code, updates)
             updated_count += 1
             print(f"Updated {store_code}: {updates}")
     
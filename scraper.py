@@ -5,6 +5,7 @@ import argparse
 from bs4 import BeautifulSoup
 from dotenv import load_dotenv
 from playwright.sync_api import sync_playwright
+from changelog import save_store
 
 load_dotenv(override=True)
 
@@ -204,7 +205,6 @@ def process_store(session_page, store_code, db):
     else:
         print("Data table not found.")
 
-    from tinydb import Query
     from datetime import datetime
 
     from geopy.geocoders import Nominatim
@@ -248,7 +248,6 @@ def process_store(session_page, store_code, db):
             print(f"Geocoding error for {store_name}: {e}")
 
     # --- Save Record ---
-    Store = Query()
     store_record = {
         "store_code": store_code,
         "store_name": store_name,
@@ -259,14 +258,15 @@ def process_store(session_page, store_code, db):
     }
     
     # Only update city/state if we have valid data
-    # This preserves existing DB values if we failed to fetch new ones (e.g. store is closed)
-    # and avoids an extra DB read.
+    # This preserves existing DB values if we failed to fetch new ones (e.g. store is closed).
     if city != "Unknown":
         store_record["city"] = city
     if state != "Unknown":
         store_record["state"] = state
     
-    db.upsert(store_record, Store.store_code == store_code)
+    # Writes and logs only what changed; a re-scrape with identical data touches neither
+    # the DB nor the change log (last_updated_at then keeps the last real change)
+    save_store(db, store_code, store_record, upsert=True, ignore=("last_updated_at",))
     print(f"Saved {store_code}. Status: {status}, Location: {city}, {state}")
     return len(yearly_data)
 
@@ -0,0 +1,255 @@
+import json
+import os
+
+import pytest
+from tinydb import TinyDB
+
+import changelog
+
+
+@pytest.fixture
+def log(tmp_path):
+    return str(tmp_path / 'changes.jsonl')
+
+
+@pytest.fixture
+def app_module(tmp_path, monkeypatch):
+    # app opens its DB at import time, so import it from inside the temp dir
+    monkeypatch.chdir(tmp_path)
+    import app
+
+    db = TinyDB(str(tmp_path / 'db.json'))
+    monkeypatch.setattr(app, 'db', db)
+    monkeypatch.setattr(app, 'db_path', str(tmp_path / 'db.json'))
+    monkeypatch.setattr(app, 'log_path', str(tmp_path / 'changes.jsonl'))
+    monkeypatch.setattr(app, '_log_offset', None)
+    monkeypatch.setattr(app, '_log_id', None)
+    monkeypatch.setattr(app, '_db_mtime', None)
+    monkeypatch.setattr(app, '_records', {})
+    monkeypatch.setattr(app, '_rows', {})
+    yield app
+    db.close()
+
+
+def test_read_changes_assigns_offsets_as_ids(log):
+    changelog.append_change('A001', {'city': 'Pune'}, path=log)
+    first_end = changelog.log_size(path=log)
+    changelog.append_change('A002', {'city': 'Agra'}, path=log)
+
+    events, offset = changelog.read_changes(0, path=log)
+
+    assert [e['store_code'] for e in events] == ['A001', 'A002']
+    assert events[0]['id'] == first_end
+    assert events[1]['id'] == offset == changelog.log_size(path=log)
+    assert changelog.read_changes(first_end, path=log)[0] == events[1:]
+
+
+def test_read_changes_stops_at_partial_line(log):
+    changelog.append_change('A001', {'city': 'Pune'}, path=log)
+    complete = changelog.log_size(path=log)
+    with open(log, 'a', encoding='utf-8') as f:
+        f.write('{"op":"update","store_code":"A0')
+
+    events, offset = changelog.read_changes(0, path=log)
+
+    assert len(events) == 1
+    assert offset == complete
+
+
+def test_read_changes_skips_malformed_line(log):
+    with open(log, 'a', encoding='utf-8') as f:
+        f.write('not json\n')
+    changelog.append_change('A001', {'city': 'Pune'}, path=log)
+
+    events, offset = changelog.read_changes(0, path=log)
+
+    assert [e['store_code'] for e in events] == ['A001']
+    assert offset == changelog.log_size(path=log)
+
+
+def test_missing_log_reads_as_empty(log):
+    assert changelog.log_size(path=log) == 0
+    assert changelog.log_id(path=log) is None
+    assert changelog.read_changes(0, path=log) == ([], 0)
+
+
+def test_append_change_rotates_large_log(log, monkeypatch):
+    monkeypatch.setattr(changelog, 'MAX_LOG_BYTES', 10)
+    changelog.append_change('A001', {'city': 'Pune'}, path=log)
+    changelog.append_change('A002', {'city': 'Agra'}, path=log)
+
+    events, _ = changelog.read_changes(0, path=log)
+    rotated, _ = changelog.read_changes(0, path=log + '.1')
+
+    assert [e['store_code'] for e in events] == ['A002']
+    assert [e['store_code'] for e in rotated] == ['A001']
+
+
+def test_changed_fields():
+    current = {'store_name': 'Pune 1', 'status': 'Active', 'last_updated_at': 'x'}
+    fields = {'store_name': 'Pune 1', 'status': 'Closed', 'last_updated_at': 'y'}
+
+    assert changelog.changed_fields(current, fields, ignore=('last_updated_at',)) == {'status': 'Closed'}
+    assert changelog.changed_fields(None, {'status': 'Active'}) == {'status': 'Active'}
+
+
+def test_sync_cache_applies_update_and_upsert(app_module):
+    app = app_module
+    app.db.insert({'store_code': 'A001', 'store_name': 'Pune 1', 'yearly_data': []})
+    app.sync_cache()
+
+    # Update to a missing store is ignored, as TinyDB's update() would be
+    changelog.append_change('A009', {'city': 'Agra'}, path=app.log_path)
+    changelog.append_change('A001', {'city': 'Pune'}, path=app.log_path)
+    changelog.append_change('A002', {'store_code': 'A002', 'store_name': 'Agra 1'}, op='upsert', path=app.log_path)
+    app.sync_cache()
+
+    assert set(app._records) == {'A001', 'A002'}
+    assert app._rows['A001']['city'] == 'Pune'
+    assert app._rows['A002']['store_name'] == 'Agra 1'
+    assert app._log_offset == changelog.log_size(path=app.log_path)
+
+
+def test_sync_cache_reloads_after_truncation(app_module):
+    app = app_module
+    changelog.append_change('A001', {'city': 'Pune'}, path=app.log_path)
+    app.sync_cache()
+    assert app._records == {}
+
+    app.db.insert({'store_code': 'A001', 'store_name': 'Pune 1'})
+    open(app.log_path, 'w').close()
+    app.sync_cache()
+
+    assert app._rows['A001']['store_name'] == 'Pune 1'
+    assert app._log_offset == 0
+
+
+def test_sync_cache_reloads_after_unlogged_db_write(app_module):
+    app = app_module
+    app.db.insert({'store_code': 'A001', 'store_name': 'Pune 1'})
+    changelog.append_change('A001', {'store_name': 'Pune 1'}, path=app.log_path)
+    os.utime(app.db_path, (1000, 1000))
+    os.utime(app.log_path, (2000, 2000))
+    app.sync_cache()
+
+    # Write straight to the DB with no log line
+    app.db.insert({'store_code': 'A002', 'store_name': 'Agra 1'})
+    os.utime(app.db_path, (3000, 3000))
+    app.sync_cache()
+
+    assert set(app._records) == {'A001', 'A002'}
+
+
+def read_stream(app, headers, count, query=''):
+    resp = app.app.test_client().get('/api/changes' + query, headers=headers)
+    stream = resp.response
+    assert next(stream) == b'retry: 3000\n\n'
+    messages = [next(stream).decode() for _ in range(count)]
+    resp.close()
+    return messages
+
+
+def test_change_stream_ids_resume_per_store(app_module):
+    app = app_module
+    app.db.insert({'store_code': 'A001', 'store_name': 'Pune 1'})
+    app.db.insert({'store_code': 'A002', 'store_name': 'Agra 1'})
+    changelog.append_change('A001', {'city': 'Pune'}, path=app.log_path)
+    changelog.append_change('A002', {'city': 'Agra'}, path=app.log_path)
+    changelog.append_change('A001', {'state': 'Maharashtra'}, op='upsert', path=app.log_path)
+    events, _ = changelog.read_changes(0, path=app.log_path)
+
+    log_id = changelog.log_id(path=app.log_path)
+    messages = read_stream(app, {'Last-Event-ID': f'{log_id}:0'}, 2)
+
+    ids = [m.split('\n')[0][len('id: '):] for m in messages]
+    payloads = [json.loads(m.split('\n')[1][len('data: '):]) for m in messages]
+    assert ids == [f"{log_id}:{events[1]['id']}", f"{log_id}:{events[2]['id']}"]
+    assert [p['store_code'] for p in payloads] == ['A002', 'A001']
+    assert payloads[1]['op'] == 'upsert'
+    assert payloads[1]['fields'] == ['city', 'state']
+
+
+def test_sync_cache_reloads_after_rotation(app_module, monkeypatch):
+    app = app_module
+    app.db.insert({'store_code': 'A001', 'store_name': 'Pune 1'})
+    changelog.append_change('A001', {'city': 'Pune'}, path=app.log_path)
+    app.sync_cache()
+
+    # Rotated log has grown past the old offset; its events must not be read from there
+    monkeypatch.setattr(changelog, 'MAX_LOG_BYTES', 1)
+    app.db.insert({'store_code': 'A002', 'store_name': 'Agra 1'})
+    changelog.append_change('A002', {'store_code': 'A002', 'store_name': 'Agra 1', 'city': 'Agra'}, op='upsert', path=app.log_path)
+    app.sync_cache()
+
+    assert set(app._records) == {'A001', 'A002'}
+    assert app._log_offset == changelog.log_size(path=app.log_path)
+
+
+def test_save_store_skips_unchanged_rescrape(app_module, monkeypatch):
+    app = app_module
+    record = {'store_code': 'A001', 'store_name': 'Pune 1', 'status': 'Active',
+              'last_updated_at': 't1', 'yearly_data': []}
+    changelog.save_store(app.db, 'A001', record, upsert=True, ignore=('last_updated_at',), path=app.log_path)
+    app.sync_cache()
+
+    reloads = []
+    all_records = app.db.all
+    monkeypatch.setattr(app.db, 'all', lambda: reloads.append(1) or all_records())
+    log_before = changelog.log_size(path=app.log_path)
+
+    # Same data scraped again: no DB write, no log line, no cache reload
+    written = changelog.save_store(app.db, 'A001', dict(record, last_updated_at='t2'), upsert=True,
+                                   ignore=('last_updated_at',), path=app.log_path)
+    app.sync_cache()
+
+    assert written == {}
+    assert changelog.log_size(path=app.log_path) == log_before
+    assert app.db.get(doc_id=1)['last_updated_at'] == 't1'
+    assert reloads == []
+
+    # A real change is written with its timestamp and applied incrementally
+    written = changelog.save_store(app.db, 'A001', dict(record, status='Closed', last_updated_at='t3'), upsert=True,
+                                   ignore=('last_updated_at',), path=app.log_path)
+    app.sync_cache()
+
+    assert written == {'status': 'Closed', 'last_updated_at': 't3'}
+    assert app._rows['A001']['status'] == 'Closed'
+    assert reloads == []
+
+
+def test_change_stream_restarts_when_token_is_from_rotated_log(app_module, monkeypatch):
+    app = app_module
+    app.db.insert({'store_code': 'A001', 'store_name': 'Pune 1'})
+    app.db.insert({'store_code': 'A002', 'store_name': 'Agra 1'})
+    changelog.save_store(app.db, 'A001', {'city': 'Pune'}, path=app.log_path)
+    old_token = app.app.test_client().get('/api/stores').json['offset']
+
+    # Log rotates before the page's stream connects; the new file outgrows the old offset
+    monkeypatch.setattr(changelog, 'MAX_LOG_BYTES', 1)
+    changelog.save_store(app.db, 'A002', {'city': 'Agra', 'state': 'Uttar Pradesh'}, path=app.log_path)
+    monkeypatch.setattr(changelog, 'MAX_LOG_BYTES', 5 * 1024 * 1024)
+    changelog.save_store(app.db, 'A001', {'state': 'Maharashtra'}, path=app.log_path)
+    assert changelog.log_size(path=app.log_path) > int(old_token.split(':')[1])
+
+    messages = read_stream(app, {}, 2, query=f'?since={old_token}')
+
+    payloads = [json.loads(m.split('\n')[1][len('data: '):]) for m in messages]
+    assert [p['store_code'] for p in payloads] == ['A002', 'A001']
+    assert payloads[0]['row']['city'] == 'Agra'
+
+
+def test_update_locations_logs_only_changed_values(app_module):
+    app = app_module
+    app.db.insert({'store_code': 'A001', 'store_name': 'Pune 1', 'city': 'Pune', 'state': 'Unknown'})
+    client = app.app.test_client()
+
+    # Same value saved again: nothing written or logged
+    resp = client.post('/api/update_locations', json={'updates': [{'storeCode': 'A001', 'city': 'Pune'}]})
+    assert resp.json['updated'] == 0
+    assert changelog.log_size(path=app.log_path) == 0
+
+    resp = client.post('/api/update_locations',
+                       json={'updates': [{'storeCode': 'A001', 'city': 'Pune', 'state': 'Maharashtra'}]})
+    events, _ = changelog.read_changes(0, path=app.log_path)
+    assert resp.json['updated'] == 1
+    assert [e['fields'] for e in events] == [{'state': 'Maharashtra'}]